@@ -1,15 +1,26 @@
 import os
-import json
-import uuid
+import gzip
+import hashlib
+import ipaddress
+import secrets
 import time
+import asyncio
+import logging
 import sqlite3
-from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Dict, Optional, Tuple
-
-import geoip2.database
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from collections import deque
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Deque, Dict, List, Optional, Tuple
+
+import maxminddb
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 
 # =========================
 # Config
@@ -18,12 +29,35 @@ APP_TITLE = "ランダムテキストチャット（超シンプル）"
 DB_PATH = os.getenv("DB_PATH", "app.db")
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # RenderのEnvironmentで設定推奨
 GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "GeoLite2-City.mmdb")  # mmdbを同階層に置く or Path指定
+OUT_QUEUE_MAX = 64  # 1クライアントあたりの未送信フレーム上限
+CONTROL_HEADROOM = 8  # そのうち matched / ended などの状態遷移用に msg / stats では埋めない分
+
+logger = logging.getLogger("uvicorn.error")
 
 _geo_reader = None
+_db: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()  # 共有接続（書き込み用）は to_thread のスレッドから触るので直列化
+_read_local = threading.local()  # スレッドごとの読み取り専用接続（スレッドが消えたら一緒に閉じる）
+_read_holders: "weakref.WeakSet[_ReadConn]" = weakref.WeakSet()  # 停止時に閉じるための一覧
+_read_gen = 0  # db_close() で進める。古い世代の接続は開き直す
+DB_BUSY_TIMEOUT_MS = 30000
+totals: Dict[str, int] = {"connects": 0, "disconnects": 0, "messages": 0}
+RECENT_CONNECTIONS_MAX = 200  # /admin/recent の limit 上限と同じ
+recent_connections: Deque[dict] = deque(maxlen=RECENT_CONNECTIONS_MAX)  # 新しい順
+
+
+_ts_cache: Tuple[int, str] = (-1, "")  # (秒, "YYYY-MM-DDTHH:MM:SS")
 
 
 def utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+    # 秒までの部分は1秒に1回だけ作り、マイクロ秒だけ毎回付ける
+    # （datetime.isoformat() と同じ形式、ただしマイクロ秒は常に6桁）
+    global _ts_cache
+    now = time.time()
+    sec = int(now)
+    if _ts_cache[0] != sec:
+        _ts_cache = (sec, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec)))
+    return f"{_ts_cache[1]}.{int((now - sec) * 1_000_000):06d}+00:00"
 
 
 # =========================
@@ -39,10 +73,59 @@ def fake_online_offset() -> int:
 # DB
 # =========================
 def db_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    return conn
+    """
+    プロセス内で使い回す接続（初回だけ開く）
+    isolation_level=None で autocommit。PRAGMA は init_db() で一度だけ設定する
+    """
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    return _db
+
+
+class _ReadConn:
+    # sqlite3.Connection は弱参照できないので包む
+    __slots__ = ("conn", "gen", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection, gen: int):
+        self.conn = conn
+        self.gen = gen
+
+    def __del__(self):
+        self.conn.close()
+
+
+def db_read_conn() -> sqlite3.Connection:
+    """
+    admin の読み取り用。threadpool のスレッドごとに1本持つ
+    WAL なので書き込み中でも読めて、書き込み用の共有接続のロックとも取り合わない
+    threading.local に置くので、アイドルで終了したスレッドの接続はそのまま閉じられる
+    """
+    holder = getattr(_read_local, "holder", None)
+    if holder is None or holder.gen != _read_gen:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA query_only=ON;")
+        conn.execute("PRAGMA mmap_size=268435456;")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+        holder = _ReadConn(conn, _read_gen)
+        _read_local.holder = holder
+        _read_holders.add(holder)
+    return holder.conn
+
+
+def db_close():
+    global _db, _read_gen
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+    # 閉じた接続は各スレッドの次の db_read_conn() で開き直される
+    _read_gen += 1
+    for holder in list(_read_holders):
+        holder.conn.close()
+
+
+SCHEMA_VERSION = 5  # テーブル/インデックスを変えたら上げる
 
 
 def _ensure_column(cur: sqlite3.Cursor, table: str, col: str, col_type: str):
@@ -52,14 +135,35 @@ def _ensure_column(cur: sqlite3.Cursor, table: str, col: str, col_type: str):
         cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
 
 
-def init_db():
-    conn = db_conn()
-    cur = conn.cursor()
+def _rebuild_with_integer_id(cur: sqlite3.Cursor, table: str, ddl: str):
+    """
+    旧版の id TEXT PRIMARY KEY（uuid）のテーブルを id INTEGER PRIMARY KEY で作り直す
+    id はどこからも参照していないので捨てて、行は元の rowid 順に移す
+    """
+    cur.execute(f"PRAGMA table_info({table})")
+    old_cols = {row[1]: row[2] for row in cur.fetchall()}
+    if old_cols.get("id", "INTEGER").upper() == "INTEGER":
+        return
 
-    cur.execute(
-        """
+    legacy = f"{table}_legacy"
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        # インデックスは旧テーブルごと消えるので、後で作り直す
+        cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cur.execute(ddl)
+        cur.execute(f"PRAGMA table_info({table})")
+        cols = ", ".join(row[1] for row in cur.fetchall() if row[1] != "id" and row[1] in old_cols)
+        cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {legacy} ORDER BY rowid")
+        cur.execute(f"DROP TABLE {legacy}")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+
+
+DDL_CONNECTIONS = """
     CREATE TABLE IF NOT EXISTS ws_connections (
-        id TEXT PRIMARY KEY,
+        id INTEGER PRIMARY KEY,        -- rowid（追記順に並ぶ）
         ts TEXT NOT NULL,
         event TEXT NOT NULL,           -- connect / disconnect
         client_id TEXT,
@@ -72,11 +176,25 @@ def init_db():
         user_agent TEXT
     )
     """
+
+DDL_MESSAGES = """
+    CREATE TABLE IF NOT EXISTS ws_messages (
+        id INTEGER PRIMARY KEY,
+        ts TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        sender_client_id TEXT NOT NULL,
+        text TEXT NOT NULL
     )
+    """
+
+
+def _create_schema(cur: sqlite3.Cursor):
+    cur.execute(DDL_CONNECTIONS)
 
     _ensure_column(cur, "ws_connections", "region", "TEXT")
     _ensure_column(cur, "ws_connections", "city", "TEXT")
     _ensure_column(cur, "ws_connections", "subdivision", "TEXT")
+    _rebuild_with_integer_id(cur, "ws_connections", DDL_CONNECTIONS)
 
     cur.execute(
         """
@@ -107,20 +225,205 @@ def init_db():
     _ensure_column(cur, "ws_sessions", "subdivision_a", "TEXT")
     _ensure_column(cur, "ws_sessions", "subdivision_b", "TEXT")
 
+    cur.execute(DDL_MESSAGES)
+    _rebuild_with_integer_id(cur, "ws_messages", DDL_MESSAGES)
+
+    # admin 集計用（geo_summary の event/region 絞り込み＋GROUP BY、recent / messages の ts 降順）
+    cur.execute("DROP INDEX IF EXISTS idx_conn_event_region")  # idx_conn_event_geo に置き換え
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conn_event_geo ON ws_connections(event, region, city, subdivision)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_conn_ts ON ws_connections(ts DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_session ON ws_messages(session_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_msgs_ts ON ws_messages(ts DESC)")
+
+    # 累計カウンタ（db_flush が行の INSERT と同じトランザクションで加算する）
     cur.execute(
         """
-    CREATE TABLE IF NOT EXISTS ws_messages (
-        id TEXT PRIMARY KEY,
-        ts TEXT NOT NULL,
-        session_id TEXT NOT NULL,
-        sender_client_id TEXT NOT NULL,
-        text TEXT NOT NULL
+    CREATE TABLE IF NOT EXISTS ws_stats (
+        key TEXT PRIMARY KEY,
+        val INTEGER NOT NULL
     )
     """
     )
+    # 既存DBは最初の一回だけ数えて初期値にする
+    cur.execute(
+        "INSERT OR IGNORE INTO ws_stats VALUES ('connects', (SELECT COUNT(*) FROM ws_connections WHERE event='connect'))"
+    )
+    cur.execute(
+        "INSERT OR IGNORE INTO ws_stats VALUES ('disconnects', (SELECT COUNT(*) FROM ws_connections WHERE event='disconnect'))"
+    )
+    cur.execute("INSERT OR IGNORE INTO ws_stats VALUES ('messages', (SELECT COUNT(*) FROM ws_messages))")
 
-    conn.commit()
-    conn.close()
+    cur.execute("ANALYZE")
+
+
+def init_db():
+    conn = db_conn()
+    mode = conn.execute("PRAGMA journal_mode=WAL;").fetchone()[0]
+    if mode.lower() != "wal":
+        # 読み取り専用FSなどでは黙って DELETE のままになる
+        logger.warning("SQLite journal_mode is %s, not WAL", mode)
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA wal_autocheckpoint=1000;")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    cur = conn.cursor()
+
+    # スキーマが最新ならテーブル/カラム/インデックスの確認を丸ごと飛ばす
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] < SCHEMA_VERSION:
+        _create_schema(cur)
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # /admin/stats 用の累計は ws_stats から読み、以降は db_flush がコミットした分だけ加算
+    cur.execute("SELECT key, val FROM ws_stats")
+    totals.update(cur.fetchall())
+
+    # /admin/recent 用のリングバッファも直近分で埋めておく
+    cur.execute(
+        """
+        SELECT ts, event, client_id, session_id, ip, country, region, city, subdivision
+        FROM ws_connections
+        ORDER BY ts DESC
+        LIMIT ?
+        """,
+        (RECENT_CONNECTIONS_MAX,),
+    )
+    recent_connections.clear()
+    recent_connections.extend(connection_row(*r) for r in cur.fetchall())
+
+
+def connection_row(
+    ts: str,
+    event: str,
+    client_id: str,
+    session_id: Optional[str],
+    ip: str,
+    country: str,
+    region: str,
+    city: str,
+    subdivision: str,
+) -> dict:
+    return {
+        "ts": ts,
+        "event": event,
+        "client_id": client_id,
+        "session_id": session_id,
+        "ip": ip,
+        "country": country,
+        "region": region,
+        "city": city,
+        "subdivision": subdivision,
+    }
+
+
+# 書き込みはキューに積むだけにして、db_writer() がまとめて1トランザクションで流す
+DB_WRITE_MAX_BATCH = 256
+DB_WRITE_FLUSH_INTERVAL = 0.05  # 秒
+
+SQL_INSERT_CONNECTION = """INSERT INTO ws_connections
+        (ts, event, client_id, session_id, ip, country, region, city, subdivision, user_agent)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+SQL_START_SESSION = """INSERT INTO ws_sessions
+        (session_id, ts_start, client_a, client_b, ip_a, ip_b, country_a, country_b, region_a, region_b, city_a, city_b, subdivision_a, subdivision_b)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+SQL_END_SESSION = "UPDATE ws_sessions SET ts_end=? WHERE session_id=? AND ts_end IS NULL"
+SQL_INSERT_MESSAGE = "INSERT INTO ws_messages (ts, session_id, sender_client_id, text) VALUES (?, ?, ?, ?)"
+SQL_ADD_STAT = "UPDATE ws_stats SET val = val + ? WHERE key = ?"
+
+EVENT_STAT_KEYS = {"connect": "connects", "disconnect": "disconnects"}
+
+# イベントループに紐づくので lifespan の中で作る。None は db_writer への停止の合図
+_write_q: "Optional[asyncio.Queue[Optional[Tuple[str, tuple]]]]" = None
+
+
+def _db_enqueue(sql: str, params: tuple):
+    _write_q.put_nowait((sql, params))
+
+
+def _stats_deltas(batch: List[Tuple[str, tuple]]) -> Dict[str, int]:
+    deltas: Dict[str, int] = {}
+    for sql, params in batch:
+        if sql == SQL_INSERT_MESSAGE:
+            key = "messages"
+        elif sql == SQL_INSERT_CONNECTION:
+            key = EVENT_STAT_KEYS.get(params[1])  # params[1] = event
+        else:
+            continue
+        if key:
+            deltas[key] = deltas.get(key, 0) + 1
+    return deltas
+
+
+def db_flush(batch: List[Tuple[str, tuple]]):
+    """
+    batch をまとめて1トランザクションで書く
+    順序を崩さないよう、連続する同じ SQL だけを executemany にまとめる
+    """
+    with _db_lock:
+        conn = db_conn()
+        # 書き込みロックを最初に取る（途中で BUSY になって batch ごと失敗しないように）
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, items in groupby(batch, key=itemgetter(0)):
+                conn.executemany(sql, [params for _, params in items])
+            deltas = _stats_deltas(batch)
+            conn.executemany(SQL_ADD_STAT, [(n, key) for key, n in deltas.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        # メモリ上の累計も ws_stats と同じく、コミットできた分だけ進める
+        for key, n in deltas.items():
+            totals[key] += n
+
+
+async def db_writer(q: "asyncio.Queue[Optional[Tuple[str, tuple]]]"):
+    """
+    q から取り出してまとめて書く
+    None が来たら、それより前に積まれた分を書き切ってから抜ける（cancel では止めない）
+    """
+    try:
+        while True:
+            item = await q.get()
+            # 少し待って溜まった分を同じトランザクションに乗せる
+            if item is not None and q.qsize() < DB_WRITE_MAX_BATCH - 1:
+                await asyncio.sleep(DB_WRITE_FLUSH_INTERVAL)
+
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= DB_WRITE_MAX_BATCH or q.empty():
+                    break
+                item = q.get_nowait()
+
+            if batch:
+                try:
+                    await asyncio.to_thread(db_flush, batch)
+                except Exception:
+                    logger.exception("db flush failed (%d rows dropped)", len(batch))
+            if item is None:
+                return
+    except Exception:
+        # ここで落ちると以降の行がキューに溜まる一方になるので必ず残す
+        logger.exception("db writer stopped unexpectedly")
+        raise
+
+
+def db_drain_pending():
+    """停止時、停止の合図より後に積まれた分も書き切る"""
+    if _write_q is None:
+        return
+    batch = []
+    while not _write_q.empty():
+        item = _write_q.get_nowait()
+        if item is not None:
+            batch.append(item)
+    if batch:
+        db_flush(batch)
 
 
 def db_insert_connection(
@@ -134,14 +437,14 @@ def db_insert_connection(
     subdivision: str,
     ua: str,
 ):
-    conn = db_conn()
-    conn.execute(
-        """INSERT INTO ws_connections
-        (id, ts, event, client_id, session_id, ip, country, region, city, subdivision, user_agent)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    ts = utc_now_iso()
+    recent_connections.appendleft(
+        connection_row(ts, event, client_id, session_id, ip, country, region, city, subdivision)
+    )
+    _db_enqueue(
+        SQL_INSERT_CONNECTION,
         (
-            str(uuid.uuid4()),
-            utc_now_iso(),
+            ts,
             event,
             client_id,
             session_id,
@@ -153,8 +456,6 @@ def db_insert_connection(
             (ua or "unknown")[:500],
         ),
     )
-    conn.commit()
-    conn.close()
 
 
 def db_start_session(
@@ -172,11 +473,8 @@ def db_start_session(
     subdivision_a: str,
     subdivision_b: str,
 ):
-    conn = db_conn()
-    conn.execute(
-        """INSERT INTO ws_sessions
-        (session_id, ts_start, client_a, client_b, ip_a, ip_b, country_a, country_b, region_a, region_b, city_a, city_b, subdivision_a, subdivision_b)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    _db_enqueue(
+        SQL_START_SESSION,
         (
             session_id,
             utc_now_iso(),
@@ -194,75 +492,123 @@ def db_start_session(
             subdivision_b,
         ),
     )
-    conn.commit()
-    conn.close()
 
 
 def db_end_session(session_id: str):
-    conn = db_conn()
-    conn.execute(
-        "UPDATE ws_sessions SET ts_end=? WHERE session_id=? AND ts_end IS NULL",
-        (utc_now_iso(), session_id),
-    )
-    conn.commit()
-    conn.close()
+    _db_enqueue(SQL_END_SESSION, (utc_now_iso(), session_id))
 
 
 def db_insert_message(session_id: str, sender: str, text: str):
-    conn = db_conn()
-    conn.execute(
-        "INSERT INTO ws_messages (id, ts, session_id, sender_client_id, text) VALUES (?, ?, ?, ?, ?)",
-        (str(uuid.uuid4()), utc_now_iso(), session_id, sender, (text or "")[:2000]),
+    _db_enqueue(
+        SQL_INSERT_MESSAGE,
+        (utc_now_iso(), session_id, sender, (text or "")[:2000]),
     )
-    conn.commit()
-    conn.close()
 
 
 # =========================
 # IP / Geo
 # =========================
+MAX_IP_TEXT_LEN = 45  # IPv4 射影の IPv6 表記の最大長
+
+
+def normalize_ip(raw: Optional[str]) -> str:
+    """IP として正しければ正規化した表記、そうでなければ "unknown"（ヘッダはクライアントが自由に書ける）"""
+    if not raw or len(raw) > MAX_IP_TEXT_LEN:
+        return "unknown"
+    try:
+        addr = ipaddress.ip_address(raw)
+    except ValueError:
+        return "unknown"
+    # ::ffff:a.b.c.d は IPv4 として扱う（プライベート帯の判定と mmdb の引き方をそろえる）
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    return str(addr)
+
+
 def get_client_ip(ws: WebSocket) -> str:
     # Render等のプロキシ越しで x-forwarded-for が来る
     xff = ws.headers.get("x-forwarded-for")
     if xff:
-        return xff.split(",")[0].strip()
+        return normalize_ip(xff.split(",", 1)[0].strip())
     if ws.client:
-        return ws.client.host
+        return normalize_ip(ws.client.host)
     return "unknown"
 
 
 def _get_geo_reader():
     global _geo_reader
     if _geo_reader is None:
-        _geo_reader = geoip2.database.Reader(GEOIP_DB_PATH)
+        _geo_reader = maxminddb.open_database(GEOIP_DB_PATH)
     return _geo_reader
 
 
+def close_geo_reader():
+    global _geo_reader
+    if _geo_reader is not None:
+        _geo_reader.close()
+        _geo_reader = None
+    _lookup_geo.cache_clear()
+
+
+GEO_UNKNOWN = ("unknown", "unknown", "unknown", "unknown")
+
+# mmdb に載らないローカル/プライベート帯（LB やプロキシ内部のアドレス）は引かない
+PRIVATE_IP_PREFIXES = (
+    "10.",
+    "127.",
+    "192.168.",
+    "169.254.",
+    *(f"172.{n}." for n in range(16, 32)),
+    *(f"100.{n}." for n in range(64, 128)),  # CGNAT
+    "::1",
+    "fc",
+    "fd",
+    "fe80:",
+)
+
+
 def get_geo(ip: str) -> Tuple[str, str, str, str]:
     """
     return: (country_code, region_name, city_name, subdivision_name)
+    ip は normalize_ip() 済みのもの。キャッシュに載るのは正しい IP だけにする
     """
-    if ip in ("unknown", "127.0.0.1"):
-        return ("unknown", "unknown", "unknown", "unknown")
+    if ip == "unknown" or ip.startswith(PRIVATE_IP_PREFIXES):
+        return GEO_UNKNOWN
+    return _lookup_geo(ip)
+
+
+@lru_cache(maxsize=65536)
+def _lookup_geo(ip: str) -> Tuple[str, str, str, str]:
+    # 同じIPからの再接続が多いので結果をキャッシュする
     try:
-        reader = _get_geo_reader()
-        r = reader.city(ip)
+        r = _get_geo_reader().get(ip)
+        if not r:
+            return GEO_UNKNOWN
 
-        country = (r.country.iso_code or "unknown").upper()
+        # geoip2 の City モデルは作らず、必要な4項目だけ dict から拾う
+        country = ((r.get("country") or {}).get("iso_code") or "unknown").upper()
 
         region = "unknown"
         subdivision = "unknown"
-        if r.subdivisions:
-            most = r.subdivisions.most_specific
-            if most and most.name:
-                region = most.name
-            if len(r.subdivisions) >= 2 and r.subdivisions[1].name:
-                subdivision = r.subdivisions[1].name
-
-        city = r.city.name or "unknown"
+        subs = r.get("subdivisions")
+        if subs:
+            most = subs[-1].get("names", {}).get("en")  # most_specific
+            if most:
+                region = most
+            if len(subs) >= 2 and subs[1].get("names", {}).get("en"):
+                subdivision = subs[1]["names"]["en"]
+
+        city = (r.get("city") or {}).get("names", {}).get("en") or "unknown"
         return (country, region, city, subdivision)
     except Exception:
-        return ("unknown", "unknown", "unknown", "unknown")
+        return GEO_UNKNOWN
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse と同じだが、シリアライズは orjson（C実装）で行う"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
 
 
 def require_admin(request: Request):
@@ -276,7 +622,7 @@ def require_admin(request: Request):
 # =========================
 # Matchmaking
 # =========================
-@dataclass
+@dataclass(slots=True)
 class ClientInfo:
     ws: WebSocket
     client_id: str
@@ -286,110 +632,110 @@ class ClientInfo:
     city: str
     subdivision: str
     ua: str
-    partner_id: Optional[str] = None
+    partner: Optional["ClientInfo"] = None  # 相手を直接参照（clients を引き直さない）
     session_id: Optional[str] = None
+    out_q: "asyncio.Queue[Optional[bytes]]" = field(default_factory=lambda: asyncio.Queue(maxsize=OUT_QUEUE_MAX))
+    sender: Optional["asyncio.Task[None]"] = None  # client_sender タスク
+
+    def send(self, frame: Optional[bytes], droppable: bool = False):
+        """
+        送信キューに積むだけ（実際の送信は client_sender タスク）
+        msg / stats（droppable）は CONTROL_HEADROOM 分を残した所で捨てる
+        （相手が1回の受信ループで大量に送ってきても、状態遷移の分の空きは残る）
+        matched / ended などの状態遷移は捨てると画面が食い違うので、それでも入らなければ
+        本当に受信していないとみなし、送信タスクを止めて切断する
+        """
+        if droppable and self.out_q.qsize() >= OUT_QUEUE_MAX - CONTROL_HEADROOM:
+            return
+        try:
+            self.out_q.put_nowait(frame)
+        except asyncio.QueueFull:
+            if not droppable and self.sender is not None:
+                self.sender.cancel()
 
 
 class Matchmaker:
+    # 状態はプロセス内だけに持つので、uvicorn は必ず1ワーカーで動かす
     def __init__(self):
         self.clients: Dict[str, ClientInfo] = {}
-        self.waiting: Optional[str] = None  # 待機中の1人だけ
+        self.waiting: Deque[str] = deque()  # 来た順に並ぶ待機列
 
     def online_count(self) -> int:
         return len(self.clients)
 
     def waiting_count(self) -> int:
-        return 1 if (self.waiting and self.waiting in self.clients and not self.clients[self.waiting].partner_id) else 0
+        return len(self.waiting)
 
     def add_client(self, info: ClientInfo):
         self.clients[info.client_id] = info
 
     def remove_client(self, client_id: str):
-        if self.waiting == client_id:
-            self.waiting = None
+        try:
+            self.waiting.remove(client_id)
+        except ValueError:
+            pass
 
         info = self.clients.get(client_id)
 
         # 相手がいるなら相手側を解放
-        if info and info.partner_id:
-            partner = self.clients.get(info.partner_id)
-            if partner:
-                partner.partner_id = None
-                if partner.session_id:
-                    db_end_session(partner.session_id)
-                partner.session_id = None
+        if info and info.partner:
+            partner = info.partner
+            info.partner = None
+            partner.partner = None
+            if partner.session_id:
+                db_end_session(partner.session_id)
+            partner.session_id = None
 
         if info and info.session_id:
             db_end_session(info.session_id)
 
         self.clients.pop(client_id, None)
 
-    def force_end_my_session(self, client_id: str) -> Optional[str]:
-        """client_id のセッションを強制終了して、相手に ended を送るため相手IDを返す"""
+    def force_end_my_session(self, client_id: str) -> Optional[ClientInfo]:
+        """client_id のセッションを強制終了して、相手に ended を送るため相手を返す"""
         me = self.clients.get(client_id)
         if not me:
             return None
-        partner_id = me.partner_id
+        partner = me.partner
         sid = me.session_id
 
-        me.partner_id = None
+        me.partner = None
         me.session_id = None
         if sid:
             db_end_session(sid)
 
-        if partner_id and partner_id in self.clients:
-            partner = self.clients[partner_id]
-            partner.partner_id = None
+        if partner:
+            partner.partner = None
             partner.session_id = None
-        return partner_id
+        return partner
 
-    def match(self, client_id: str) -> Tuple[bool, Optional[str]]:
+    def match(self, client_id: str) -> Tuple[bool, Optional[ClientInfo]]:
         me = self.clients.get(client_id)
-        if not me or me.partner_id:
-            return False, None
-
-        # waiting が無効なら自分が waiting に入る
-        if (
-            not self.waiting
-            or self.waiting not in self.clients
-            or self.clients[self.waiting].partner_id
-        ):
-            self.waiting = client_id
+        if not me or me.partner:
             return False, None
 
-        other_id = self.waiting
-        if other_id == client_id:
+        # 既に並んでいるなら（start の連打など）そのまま待つ
+        if client_id in self.waiting:
             return False, None
 
-        other = self.clients.get(other_id)
-        if not other or other.partner_id:
-            self.waiting = client_id
+        # 一番長く待っている人と組む。いなければ自分が列の後ろに並ぶ
+        other = None
+        while self.waiting:
+            other = self.clients.get(self.waiting.popleft())
+            if other and not other.partner:
+                break
+            other = None
+        if other is None:
+            self.waiting.append(client_id)
             return False, None
 
         # マッチ成立
-        session_id = str(uuid.uuid4())
-        me.partner_id = other_id
-        other.partner_id = client_id
+        session_id = secrets.token_urlsafe(9)  # 72bit。数分しか使わないので十分
+        me.partner = other
+        other.partner = me
         me.session_id = session_id
         other.session_id = session_id
-        self.waiting = None
-
-        db_start_session(
-            session_id,
-            me.client_id,
-            other.client_id,
-            me.ip,
-            other.ip,
-            me.country,
-            other.country,
-            me.region,
-            other.region,
-            me.city,
-            other.city,
-            me.subdivision,
-            other.subdivision,
-        )
-        return True, other_id
+        return True, other
 
 
 mm = Matchmaker()
@@ -397,8 +743,30 @@ mm = Matchmaker()
 # =========================
 # FastAPI
 # =========================
-app = FastAPI(title="random-chat-logs")
-init_db()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(init_db)
+    # 最初の接続者が mmdb オープンを待たないよう先に開いておく
+    try:
+        _get_geo_reader()
+    except Exception:
+        logger.warning("GeoIP database not available: %s", GEOIP_DB_PATH)
+    global _write_q
+    _write_q = asyncio.Queue()
+    writer = asyncio.create_task(db_writer(_write_q))
+    pusher = asyncio.create_task(stats_pusher())
+    try:
+        yield
+    finally:
+        pusher.cancel()
+        _write_q.put_nowait(None)
+        await asyncio.gather(pusher, writer, return_exceptions=True)
+        await asyncio.to_thread(db_drain_pending)
+        await asyncio.to_thread(db_close)
+        close_geo_reader()
+
+
+app = FastAPI(title="random-chat-logs", lifespan=lifespan)
 
 INDEX_HTML = f"""
 <!doctype html>
@@ -430,13 +798,14 @@ INDEX_HTML = f"""
   <div id="log"></div>
 
   <div class="row" style="margin-top:12px;">
-    <input id="msg" placeholder="メッセージ..." style="width:min(520px, 72vw);">
+    <input id="msg" maxlength="2000" placeholder="メッセージ..." style="width:min(520px, 72vw);">
     <button id="btnSend" disabled>送信</button>
   </div>
 
 <script>
 let ws = null;
 let matched = false;
+const decoder = new TextDecoder();
 
 let clientId = localStorage.getItem("client_id");
 if(!clientId) {{
@@ -520,27 +889,44 @@ function playPingSound() {{
 async function refreshOnline() {{
   try {{
     const r = await fetch("/api/online");
-    const j = await r.json();
-    document.getElementById("onlineDisplay").textContent = j.online_display;
-    document.getElementById("waitingNow").textContent = j.waiting_now;
+    setOnline(await r.json());
   }} catch(e) {{}}
 }}
-setInterval(refreshOnline, 2000);
-refreshOnline();
+// 未接続の間だけポーリングする。接続中はサーバーから stats が届く
+let onlineTimer = null;
+function startOnlinePolling() {{
+  if(onlineTimer) return;
+  refreshOnline();
+  onlineTimer = setInterval(refreshOnline, 2000);
+}}
+function stopOnlinePolling() {{
+  clearInterval(onlineTimer);
+  onlineTimer = null;
+}}
+startOnlinePolling();
+
+function setOnline(j) {{
+  document.getElementById("onlineDisplay").textContent = j.online_display;
+  document.getElementById("waitingNow").textContent = j.waiting_now;
+}}
 
 function connect() {{
   ws = new WebSocket((location.protocol==="https:"?"wss":"ws")+"://"+location.host+"/ws?client_id="+encodeURIComponent(clientId));
+  ws.binaryType = "arraybuffer";  // サーバーはバイナリフレームで送ってくる
 
   ws.onopen = ()=> {{
+    stopOnlinePolling();
     setUIConnected(true);
     log("✅ 接続しました。マッチング中...");
     ws.send(JSON.stringify({{type:"start"}}));
   }};
 
   ws.onmessage = (ev)=> {{
-    const data = JSON.parse(ev.data);
+    const data = JSON.parse(typeof ev.data === "string" ? ev.data : decoder.decode(ev.data));
 
-    if(data.type==="matched") {{
+    if(data.type==="stats") {{
+      setOnline(data);
+    }} else if(data.type==="matched") {{
       log("🎉 マッチしました！");
       setUIMatched(true);
       playMatchSound();
@@ -564,6 +950,7 @@ function connect() {{
   ws.onclose = ()=> {{
     log("🗡 切断しました。");
     setUIConnected(false);
+    startOnlinePolling();
   }};
 }}
 
@@ -613,96 +1000,103 @@ document.getElementById("msg").addEventListener("keydown", (e)=> {{
 """
 
 
+# HTML は固定なので、エンコード・gzip・ETag は起動時に一度だけ
+INDEX_HTML_BYTES = INDEX_HTML.encode("utf-8")
+INDEX_HTML_GZIP = gzip.compress(INDEX_HTML_BYTES, 9)
+INDEX_ETAG = '"' + hashlib.sha256(INDEX_HTML_BYTES).hexdigest()[:32] + '"'
+INDEX_HEADERS = {"ETag": INDEX_ETAG, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+INDEX_GZIP_HEADERS = {**INDEX_HEADERS, "ETag": INDEX_ETAG[:-1] + '-gz"', "Content-Encoding": "gzip"}
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Accept-Encoding に gzip があり、q=0 で拒否されていなければ True"""
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        if coding.strip().lower() != "gzip":
+            continue
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
 @app.get("/", response_class=HTMLResponse)
-def index():
-    return INDEX_HTML
+async def index(request: Request):
+    gz = accepts_gzip(request.headers.get("accept-encoding", ""))
+    headers = INDEX_GZIP_HEADERS if gz else INDEX_HEADERS
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(INDEX_HTML_GZIP if gz else INDEX_HTML_BYTES, headers=headers)
 
 
 # =========================
 # Public tiny API (UI polling)
 # =========================
-@app.get("/api/online")
-def api_online():
-    real = mm.online_count()
-    fake = fake_online_offset()
-    return JSONResponse(
-        {
+# (キー, /api/online 用 JSON, WS 用 stats フレーム)
+_online_cache: Tuple[Tuple[int, int, int], bytes, bytes] = ((-1, -1, -1), b"", b"")
+
+
+def _online_cached() -> Tuple[Tuple[int, int, int], bytes, bytes]:
+    """オンライン数の JSON。値が変わった時だけ作り直す"""
+    global _online_cache
+    key = (mm.online_count(), fake_online_offset(), mm.waiting_count())
+    if _online_cache[0] != key:
+        real, fake, waiting = key
+        body = {
             "online_real": real,
             "online_display": real + fake,
-            "waiting_now": mm.waiting_count(),
+            "waiting_now": waiting,
         }
-    )
+        _online_cache = (key, orjson.dumps(body), orjson.dumps({"type": "stats", **body}))
+    return _online_cache
+
+
+def online_payload() -> bytes:
+    return _online_cached()[1]
+
+
+def stats_frame() -> bytes:
+    return _online_cached()[2]
+
+
+@app.get("/api/online")
+async def api_online():
+    return Response(online_payload(), media_type="application/json")
 
 
 # =========================
 # Admin APIs
 # =========================
 @app.get("/admin/stats")
-def admin_stats(request: Request):
+async def admin_stats(request: Request):
     require_admin(request)
 
     real = mm.online_count()
     fake = fake_online_offset()
 
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM ws_connections WHERE event='connect'")
-    total_connects = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM ws_connections WHERE event='disconnect'")
-    total_disconnects = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM ws_messages")
-    total_msgs = cur.fetchone()[0]
-    conn.close()
-
-    return JSONResponse(
+    return OrjsonResponse(
         {
             "online_real": real,
             "online_display": real + fake,
             "waiting_now": mm.waiting_count(),
-            "total_connects": total_connects,
-            "total_disconnects": total_disconnects,
-            "total_messages": total_msgs,
+            "total_connects": totals["connects"],
+            "total_disconnects": totals["disconnects"],
+            "total_messages": totals["messages"],
         }
     )
 
 
 @app.get("/admin/recent")
-def admin_recent(request: Request, limit: int = 50):
+async def admin_recent(request: Request, limit: int = 50):
     require_admin(request)
-    limit = max(1, min(limit, 200))
-
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT ts, event, client_id, session_id, ip, country, region, city, subdivision
-        FROM ws_connections
-        ORDER BY ts DESC
-        LIMIT ?
-        """,
-        (limit,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    limit = max(1, min(limit, RECENT_CONNECTIONS_MAX))
 
-    return JSONResponse(
-        {
-            "connections": [
-                {
-                    "ts": r[0],
-                    "event": r[1],
-                    "client_id": r[2],
-                    "session_id": r[3],
-                    "ip": r[4],
-                    "country": r[5],
-                    "region": r[6],
-                    "city": r[7],
-                    "subdivision": r[8],
-                }
-                for r in rows
-            ]
-        }
-    )
+    return OrjsonResponse({"connections": list(islice(recent_connections, limit))})
 
 
 @app.get("/admin/messages")
@@ -710,8 +1104,7 @@ def admin_messages(request: Request, limit: int = 100):
     require_admin(request)
     limit = max(1, min(limit, 500))
 
-    conn = db_conn()
-    cur = conn.cursor()
+    cur = db_read_conn().cursor()
     cur.execute(
         """
         SELECT ts, session_id, sender_client_id, text
@@ -722,9 +1115,8 @@ def admin_messages(request: Request, limit: int = 100):
         (limit,),
     )
     rows = cur.fetchall()
-    conn.close()
 
-    return JSONResponse(
+    return OrjsonResponse(
         {
             "messages": [
                 {
@@ -748,8 +1140,7 @@ def admin_geo_summary(request: Request, region: Optional[str] = None, limit: int
     require_admin(request)
     limit = max(1, min(limit, 200))
 
-    conn = db_conn()
-    cur = conn.cursor()
+    cur = db_read_conn().cursor()
 
     if region:
         cur.execute(
@@ -777,9 +1168,8 @@ def admin_geo_summary(request: Request, region: Optional[str] = None, limit: int
         )
 
     rows = cur.fetchall()
-    conn.close()
 
-    return JSONResponse(
+    return OrjsonResponse(
         {
             "rows": [
                 {
@@ -797,6 +1187,94 @@ def admin_geo_summary(request: Request, region: Optional[str] = None, limit: int
 # =========================
 # WebSocket
 # =========================
+def encode_frame(obj: dict) -> bytes:
+    return orjson.dumps(obj)
+
+
+def encode_msg_frame(text: str) -> bytes:
+    # 可変なのは text だけなので dict を作らず前後を連結する
+    return b'{"type":"msg","text":' + orjson.dumps(text) + b"}"
+
+
+# 固定のフレームは起動時に一度だけエンコードしておく
+FRAME_MATCHED = encode_frame({"type": "matched"})
+FRAME_ENDED = encode_frame({"type": "ended"})
+FRAME_DISCONNECT_ACK = encode_frame({"type": "disconnect_ack"})
+FRAME_SYS_WAITING = encode_frame({"type": "system", "text": "待機中...相手を探しています"})
+FRAME_SYS_NOT_MATCHED = encode_frame({"type": "system", "text": "まだマッチしていません"})
+FRAME_SYS_UNKNOWN = encode_frame({"type": "system", "text": "unknown command"})
+
+SENDER_CLOSE_TIMEOUT = 1.0  # 切断時に残りのフレームを送り切るまで待つ秒数
+STATS_PUSH_INTERVAL = 2.0  # オンライン数を WS で配る間隔（秒）
+MAX_INBOUND_CHARS = 4096  # これより長い受信フレームは 1009 で切る
+WS_CLOSE_TOO_BIG = 1009
+WS_CLOSE_TOO_SLOW = 1008
+
+# ページが送る固定コマンドは json.loads せずに種別を決める
+FIXED_COMMANDS = {
+    '{"type":"start"}': "start",
+    '{"type":"next"}': "next",
+    '{"type":"disconnect"}': "disconnect",
+}
+
+
+async def client_sender(info: ClientInfo):
+    """info.out_q を順に送る。None が来たら終了"""
+    try:
+        while True:
+            frame = await info.out_q.get()
+            if frame is None:
+                return
+            await info.ws.send_bytes(frame)
+    except asyncio.CancelledError:
+        # 受信が追いつかず状態遷移を積めなかった（ClientInfo.send）。切断して受信ループを終わらせる
+        try:
+            await asyncio.wait_for(info.ws.close(code=WS_CLOSE_TOO_SLOW), SENDER_CLOSE_TIMEOUT)
+        except Exception:
+            pass
+    except Exception:
+        # 相手が落ちている。受信ループ側の finally で片付く
+        pass
+
+
+def match_and_notify(me: ClientInfo):
+    """待機を通知してマッチングを試み、成立したら両者に matched を送る（start / next 共通）"""
+    me.send(FRAME_SYS_WAITING)
+    matched, other = mm.match(me.client_id)
+    if matched and other:
+        me.send(FRAME_MATCHED)
+        other.send(FRAME_MATCHED)
+        # 記録は通知を積んだ後でいい（書き込みキューへ積むだけ）
+        db_start_session(
+            me.session_id,
+            me.client_id,
+            other.client_id,
+            me.ip,
+            other.ip,
+            me.country,
+            other.country,
+            me.region,
+            other.region,
+            me.city,
+            other.city,
+            me.subdivision,
+            other.subdivision,
+        )
+
+
+async def stats_pusher():
+    """オンライン数が変わっていたら、同じフレームを全員の送信キューに積む"""
+    last = None
+    while True:
+        await asyncio.sleep(STATS_PUSH_INTERVAL)
+        frame = stats_frame()
+        if frame is last:
+            continue
+        last = frame
+        for c in list(mm.clients.values()):
+            c.send(frame, droppable=True)
+
+
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket, client_id: str):
     await ws.accept()
@@ -816,89 +1294,85 @@ async def ws_endpoint(ws: WebSocket, client_id: str):
         ua=ua,
     )
     mm.add_client(info)
+    info.sender = asyncio.create_task(client_sender(info))
+    info.send(stats_frame(), droppable=True)
 
     db_insert_connection("connect", client_id, None, ip, country, region, city, subdivision, ua)
 
     try:
         while True:
             raw = await ws.receive_text()
-            data = json.loads(raw)
-            typ = data.get("type")
+            if len(raw) > MAX_INBOUND_CHARS:
+                await ws.close(code=WS_CLOSE_TOO_BIG)
+                break
+
+            typ = FIXED_COMMANDS.get(raw)
+            data = None
+            if typ is None:
+                if not raw.startswith("{"):
+                    info.send(FRAME_SYS_UNKNOWN)
+                    continue
+                try:
+                    data = orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    info.send(FRAME_SYS_UNKNOWN)
+                    continue
+                typ = data.get("type") if isinstance(data, dict) else None
             me = mm.clients.get(client_id)
 
             if typ == "start":
-                await ws.send_text(json.dumps({"type": "system", "text": "待機中...相手を探しています"}))
-                matched, other_id = mm.match(client_id)
-                if matched and other_id:
-                    other = mm.clients.get(other_id)
-                    if other and me:
-                        await me.ws.send_text(json.dumps({"type": "matched"}))
-                        await other.ws.send_text(json.dumps({"type": "matched"}))
+                match_and_notify(info)
 
             elif typ == "next":
                 # 今の相手を切って次へ
-                if me and me.partner_id:
-                    partner = mm.clients.get(me.partner_id)
+                if me and me.partner:
+                    partner = me.partner
                     sid = me.session_id
-                    me.partner_id = None
+                    me.partner = None
                     me.session_id = None
                     if sid:
                         db_end_session(sid)
-                    if partner:
-                        partner.partner_id = None
-                        partner.session_id = None
-                        await partner.ws.send_text(json.dumps({"type": "ended"}))
-
-                await ws.send_text(json.dumps({"type": "system", "text": "待機中...相手を探しています"}))
-                matched, other_id = mm.match(client_id)
-                if matched and other_id:
-                    other = mm.clients.get(other_id)
-                    if other and me:
-                        await me.ws.send_text(json.dumps({"type": "matched"}))
-                        await other.ws.send_text(json.dumps({"type": "matched"}))
+                    partner.partner = None
+                    partner.session_id = None
+                    partner.send(FRAME_ENDED)
+
+                match_and_notify(info)
 
             elif typ == "disconnect":
                 # 自分から切断
-                partner_id = mm.force_end_my_session(client_id)
-                if partner_id and partner_id in mm.clients:
-                    try:
-                        await mm.clients[partner_id].ws.send_text(json.dumps({"type": "ended"}))
-                    except Exception:
-                        pass
-                await ws.send_text(json.dumps({"type": "disconnect_ack"}))
+                partner = mm.force_end_my_session(client_id)
+                if partner:
+                    partner.send(FRAME_ENDED)
+                info.send(FRAME_DISCONNECT_ACK)
                 break  # finallyへ
 
             elif typ == "msg":
-                text = (data.get("text") or "").strip()
+                text = data.get("text")
+                if not isinstance(text, str):
+                    info.send(FRAME_SYS_UNKNOWN)
+                    continue
+                text = text.strip()
                 if not text:
                     continue
 
                 if me and me.session_id:
                     db_insert_message(me.session_id, client_id, text)
 
-                if me and me.partner_id and me.partner_id in mm.clients:
-                    partner = mm.clients[me.partner_id]
-                    await partner.ws.send_text(json.dumps({"type": "msg", "text": text}))
+                if me and me.partner:
+                    me.partner.send(encode_msg_frame(text), droppable=True)
                 else:
-                    await ws.send_text(json.dumps({"type": "system", "text": "まだマッチしていません"}))
+                    info.send(FRAME_SYS_NOT_MATCHED)
 
             else:
-                await ws.send_text(json.dumps({"type": "system", "text": "unknown command"}))
+                info.send(FRAME_SYS_UNKNOWN)
 
     except WebSocketDisconnect:
         pass
     finally:
         # 相手が急に落ちた時に、残ってる側へ ended を送る
-        partner_id = None
         info2 = mm.clients.get(client_id)
-        if info2:
-            partner_id = info2.partner_id
-
-        if partner_id and partner_id in mm.clients:
-            try:
-                await mm.clients[partner_id].ws.send_text(json.dumps({"type": "ended"}))
-            except Exception:
-                pass
+        if info2 and info2.partner:
+            info2.partner.send(FRAME_ENDED)
 
         session_id = None
         info2 = mm.clients.get(client_id)
@@ -907,3 +1381,24 @@ async def ws_endpoint(ws: WebSocket, client_id: str):
 
         db_insert_connection("disconnect", client_id, session_id, ip, country, region, city, subdivision, ua)
         mm.remove_client(client_id)
+
+        # disconnect_ack など積み残しを送ってから送信タスクを止める
+        info.send(None)
+        try:
+            await asyncio.wait_for(info.sender, SENDER_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvicorn[standard] に含まれる uvloop / httptools を明示して1ワーカーで起動
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+    )
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+
+import app
+
+
+class FakeWebSocket:
+    """send_bytes ごとに1回だけループへ譲る。blocked の間は受信しない相手として止まる"""
+
+    def __init__(self, blocked: bool = False):
+        self.blocked = blocked
+        self.frames = []
+        self.close_code = None
+
+    async def send_bytes(self, frame: bytes):
+        while self.blocked:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(0)
+        self.frames.append(frame)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def make_client(ws: FakeWebSocket) -> app.ClientInfo:
+    info = app.ClientInfo(
+        ws=ws,
+        client_id="victim",
+        ip="unknown",
+        country="unknown",
+        region="unknown",
+        city="unknown",
+        subdivision="unknown",
+        ua="test",
+    )
+    info.sender = asyncio.create_task(app.client_sender(info))
+    return info
+
+
+class ClientQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_of_msgs_then_control_keeps_client(self):
+        # 相手が1回の受信ループで msg を大量に送ってから next / 切断した場合
+        ws = FakeWebSocket()
+        info = make_client(ws)
+        await asyncio.sleep(0)
+
+        for i in range(200):
+            info.send(app.encode_msg_frame(str(i)), droppable=True)
+        info.send(app.FRAME_ENDED)
+        info.send(None)
+        await asyncio.wait_for(info.sender, 1.0)
+
+        self.assertIsNone(ws.close_code)
+        self.assertEqual(ws.frames[-1], app.FRAME_ENDED)
+
+    async def test_client_not_reading_is_closed(self):
+        ws = FakeWebSocket(blocked=True)
+        info = make_client(ws)
+        await asyncio.sleep(0)
+
+        for _ in range(app.OUT_QUEUE_MAX + 1):
+            info.send(app.FRAME_SYS_UNKNOWN)
+        await asyncio.wait_for(info.sender, 1.0)
+
+        self.assertEqual(ws.close_code, app.WS_CLOSE_TOO_SLOW)
+
+
+if __name__ == "__main__":
+    unittest.main()
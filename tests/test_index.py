@@ -0,0 +1,20 @@
+import unittest
+
+import app
+
+
+class AcceptsGzipTest(unittest.TestCase):
+    def test_plain_and_positive_q(self):
+        self.assertTrue(app.accepts_gzip("gzip"))
+        self.assertTrue(app.accepts_gzip("gzip, deflate, br"))
+        self.assertTrue(app.accepts_gzip("br, GZIP; q=0.5"))
+
+    def test_refused_or_absent(self):
+        self.assertFalse(app.accepts_gzip("br;q=1.0, gzip;q=0"))
+        self.assertFalse(app.accepts_gzip("gzip;q=0.000"))
+        self.assertFalse(app.accepts_gzip("deflate, br"))
+        self.assertFalse(app.accepts_gzip(""))
+
+
+if __name__ == "__main__":
+    unittest.main()